@@ -1,10 +1,19 @@
 # tag::imports[]
+import asyncio
+import base64
+import json
+import logging
 import os
-from collections.abc import AsyncIterator
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
+from functools import partial
+from typing import Any
 
-from neo4j import AsyncGraphDatabase, AsyncDriver
+from neo4j import AsyncGraphDatabase, AsyncDriver, EagerResult, RoutingControl
+from neo4j.exceptions import Neo4jError
 from mcp.server.fastmcp import FastMCP
 
 # Load environment variables from .env file
@@ -14,18 +23,49 @@ load_dotenv()
 
 
 # tag::appcontext[]
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AppContext:
     """Application context with Neo4j driver."""
     driver: AsyncDriver
     database: str
+    execute: Callable[..., Awaitable[EagerResult]]
 # end::appcontext[]
 
 
 # tag::lifespan[]
-@asynccontextmanager
-async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
-    """Manage Neo4j driver lifecycle."""
+# Indexes that turn the tools' genre filter, movie lookup and title ordering into seeks
+INDEX_STATEMENTS = (
+    "CREATE RANGE INDEX movie_title IF NOT EXISTS FOR (m:Movie) ON (m.title)",
+    "CREATE RANGE INDEX movie_tmdb_id IF NOT EXISTS FOR (m:Movie) ON (m.tmdbId)",
+    "CREATE RANGE INDEX genre_name IF NOT EXISTS FOR (g:Genre) ON (g.name)",
+)
+indexes_created = False
+
+logger = logging.getLogger(__name__)
+
+
+async def create_indexes(execute: Callable[..., Awaitable[EagerResult]]) -> None:
+    """Create each tool index once per process, continuing without any that fail."""
+    global indexes_created
+    if indexes_created:
+        return
+    indexes_created = True
+
+    for statement in INDEX_STATEMENTS:
+        try:
+            await execute(statement, routing_=RoutingControl.WRITE)
+        except Neo4jError as e:
+            logger.warning("Could not create index, continuing without it: %s", e)
+
+
+# One driver, connection pool and routing table shared by every MCP session
+shared_context: AppContext | None = None
+session_count = 0
+shared_context_lock = asyncio.Lock()
+
+
+async def create_app_context() -> AppContext:
+    """Create the Neo4j driver and the query executor used by the tools."""
 
     # Read connection details from environment
     uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
@@ -33,47 +73,103 @@ async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
     password = os.getenv("NEO4J_PASSWORD", "password")
     database = os.getenv("NEO4J_DATABASE", "neo4j")
 
-    # Initialize driver on startup
-    driver = AsyncGraphDatabase.driver(uri, auth=(username, password))
+    # Initialize driver, giving up sooner than the driver's defaults
+    # when the pool is exhausted or the server is unreachable
+    driver = AsyncGraphDatabase.driver(
+        uri,
+        auth=(username, password),
+        connection_acquisition_timeout=30,
+        connection_timeout=10,
+    )
+
+    # Bind the database once so every query runs against it.
+    # The tools only read, so route their queries to any cluster member.
+    execute = partial(driver.execute_query, database_=database, routing_=RoutingControl.READ)
+
+    try:
+        # Open a connection now rather than on the first query
+        await driver.verify_connectivity()
+
+        # Make sure the indexes used by the tools exist
+        await create_indexes(execute)
+    except Exception:
+        await driver.close()
+        raise
+
+    # Serve repeat read-only lookups from the query cache
+    execute = cache_reads(execute)
+
+    return AppContext(driver=driver, database=database, execute=execute)
+
+
+@asynccontextmanager
+async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
+    """Share one Neo4j driver across MCP sessions, closing it with the last one."""
+    global shared_context, session_count
+
+    # FastMCP enters the lifespan once per session, so reuse the driver
+    # of any session that is still open
+    async with shared_context_lock:
+        if shared_context is None:
+            shared_context = await create_app_context()
+        session_count += 1
 
     try:
         # Yield context with driver
-        yield AppContext(driver=driver, database=database)
+        yield shared_context
     finally:
-        # Close driver on shutdown
-        await driver.close()
+        # Close driver on shutdown, once no session is using it
+        async with shared_context_lock:
+            session_count -= 1
+            if session_count == 0:
+                await shared_context.driver.close()
+                shared_context = None
 # end::lifespan[]
 
 # tag::server[]
 # Create server with lifespan
 mcp = FastMCP("Movies GraphRAG Server", lifespan=app_lifespan)
+
+# Cap on rows per tool call so a large limit cannot buffer an unbounded result
+MAX_RESULTS = 500
 # end::server[]
 
 
 # tag::graph_statistics[]
 from mcp.server.fastmcp import Context
 
+# Each unfiltered count is a query of its own so the planner answers it from the count store
+NODE_COUNT_QUERY = "MATCH (n) RETURN count(n) AS nodes"
+RELATIONSHIP_COUNT_QUERY = "MATCH ()-[r]->() RETURN count(r) AS relationships"
+
 @mcp.tool()
 async def graph_statistics(ctx: Context) -> dict[str, int]:
     """Count the number of nodes and relationships in the graph."""
 
-    # Access the driver from lifespan context
-    driver = ctx.request_context.lifespan_context.driver
-    database = ctx.request_context.lifespan_context.database
+    # Access the query executor from lifespan context
+    execute = ctx.request_context.lifespan_context.execute
 
-    # Use the driver to query Neo4j with the correct database
-    records, summary, keys = await driver.execute_query(
-        r"RETURN COUNT {()} AS nodes, COUNT {()-[]-()} AS relationships",
-        database_=database
-    )
+    # Query Neo4j for each count
+    node_records, _, _ = await execute(NODE_COUNT_QUERY)
+    relationship_records, _, _ = await execute(RELATIONSHIP_COUNT_QUERY)
 
-    # Process the results
-    if records:
-        return dict(records[0])
-    return {"nodes": 0, "relationships": 0}
+    # An aggregation without grouping keys always returns exactly one row
+    return {
+        "nodes": node_records[0]["nodes"],
+        "relationships": relationship_records[0]["relationships"],
+    }
 # end::graph_statistics[]
 
 # tag::get_movies_by_genre[]
+MOVIES_BY_GENRE_QUERY = """
+MATCH (m:Movie)-[:IN_GENRE]->(g:Genre {name: $genre})
+RETURN m.title AS title,
+       m.imdbRating AS imdbRating,
+       m.released AS released
+ORDER BY coalesce(m.imdbRating, 0) DESC
+LIMIT $limit
+"""
+
 @mcp.tool()
 async def get_movies_by_genre(genre: str, limit: int = 10, ctx: Context = None) -> list[dict]:
     """
@@ -81,39 +177,34 @@ async def get_movies_by_genre(genre: str, limit: int = 10, ctx: Context = None)
 
     Args:
         genre: The genre to search for (e.g., "Action", "Drama", "Comedy")
-        limit: Maximum number of movies to return (default: 10)
+        limit: Maximum number of movies to return (default: 10, at most 500)
         ctx: Context object (injected automatically)
 
     Returns:
         List of movies with title, tagline, and release year
     """
 
+    limit = max(1, min(limit, MAX_RESULTS))
+
     # Log the request
     await ctx.info(f"Searching for {genre} movies (limit: {limit})...")
 
-    # Access the Neo4j driver from lifespan context
-    driver = ctx.request_context.lifespan_context.driver
+    # Access the query executor from lifespan context
+    execute = ctx.request_context.lifespan_context.execute
 
     # Log the query execution
     await ctx.debug(f"Executing Cypher query for genre: {genre}")
 
     try:
         # Execute the query
-        records, summary, keys = await driver.execute_query(
-            """
-            MATCH (m:Movie)-[:IN_GENRE]->(g:Genre {name: $genre})
-            RETURN m.title AS title,
-                   m.imdbRating AS imdbRating,
-                   m.released AS released
-            ORDER BY coalesce(m.imdbRating, 0) DESC
-            LIMIT $limit
-            """,
+        records, summary, keys = await execute(
+            MOVIES_BY_GENRE_QUERY,
             genre=genre,
             limit=limit
         )
 
         # Convert records to list of dictionaries
-        movies = [record.data() for record in records]
+        movies = [dict(zip(keys, record.values())) for record in records]
 
         # Log the result
         await ctx.info(f"Found {len(movies)} {genre} movies")
@@ -130,6 +221,18 @@ async def get_movies_by_genre(genre: str, limit: int = 10, ctx: Context = None)
 # end::get_movies_by_genre[]
 
 # tag::get_movie[]
+GET_MOVIE_QUERY = """
+MATCH (m:Movie {tmdbId: $tmdb_id})
+RETURN m.title AS title,
+       m.released AS released,
+       m.tagline AS tagline,
+       m.runtime AS runtime,
+       m.plot AS plot,
+       [ (m)-[:IN_GENRE]->(g:Genre) | g.name ] AS genres,
+       [ (p)-[r:ACTED_IN]->(m) | {name: p.name, role: r.role} ] AS actors,
+       [ (d)-[:DIRECTED]->(m) | d.name ] AS directors
+"""
+
 @mcp.resource("movie://{tmdb_id}")
 async def get_movie(tmdb_id: str, ctx: Context) -> str:
     """
@@ -143,62 +246,43 @@ async def get_movie(tmdb_id: str, ctx: Context) -> str:
     """
     await ctx.info(f"Fetching movie details for TMDB ID: {tmdb_id}")
 
-    context = ctx.request_context.lifespan_context
+    execute = ctx.request_context.lifespan_context.execute
 
     try:
-        records, _, _ = await context.driver.execute_query(
-            """
-            MATCH (m:Movie {tmdbId: $tmdb_id})
-            RETURN m.title AS title,
-               m.released AS released,
-               m.tagline AS tagline,
-               m.runtime AS runtime,
-               m.plot AS plot,
-               [ (m)-[:IN_GENRE]->(g:Genre) | g.name ] AS genres,
-               [ (p)-[r:ACTED_IN]->(m) | {name: p.name, role: r.role} ] AS actors,
-               [ (d)-[:DIRECTED]->(m) | d.name ] AS directors
-            """,
-            tmdb_id=tmdb_id,
-            database_=context.database
+        records, _, _ = await execute(
+            GET_MOVIE_QUERY,
+            tmdb_id=tmdb_id
         )
 
         if not records:
             await ctx.warning(f"Movie with TMDB ID {tmdb_id} not found")
             return f"Movie with TMDB ID {tmdb_id} not found in database"
 
-        movie = records[0].data()
-
-        # Format the output
-        output = []
-        output.append(f"# {movie['title']} ({movie['released']})")
-        output.append("")
+        title, released, tagline, runtime, plot, genres, actors, directors = records[0].values()
 
-        if movie['tagline']:
-            output.append(f"_{movie['tagline']}_")
-            output.append("")
+        # Format the optional sections
+        tagline = f"_{tagline}_\n\n" if tagline else ""
+        directors = f"**Director(s):** {', '.join(directors)}\n" if directors else ""
+        cast = ""
+        if actors:
+            cast = "\n\n## Cast\n" + "\n".join(
+                f"- {actor['name']} as {actor['role']}" if actor['role'] else f"- {actor['name']}"
+                for actor in actors
+            )
 
-        output.append(f"**Runtime:** {movie['runtime']} minutes")
-        output.append(f"**Genres:** {', '.join(movie['genres'])}")
-
-        if movie['directors']:
-            output.append(f"**Director(s):** {', '.join(movie['directors'])}")
-
-        output.append("")
-        output.append("## Plot")
-        output.append(movie['plot'])
-
-        if movie['actors']:
-            output.append("")
-            output.append("## Cast")
-            for actor in movie['actors']:
-                if actor['role']:
-                    output.append(f"- {actor['name']} as {actor['role']}")
-                else:
-                    output.append(f"- {actor['name']}")
-
-        result = "\n".join(output)
+        # Format the output
+        result = (
+            f"# {title} ({released})\n\n"
+            f"{tagline}"
+            f"**Runtime:** {runtime} minutes\n"
+            f"**Genres:** {', '.join(genres)}\n"
+            f"{directors}"
+            f"\n## Plot\n"
+            f"{plot}"
+            f"{cast}"
+        )
 
-        await ctx.info(f"Successfully fetched details for '{movie['title']}'")
+        await ctx.info(f"Successfully fetched details for '{title}'")
 
         return result
 
@@ -208,12 +292,57 @@ async def get_movie(tmdb_id: str, ctx: Context) -> str:
 # end::get_movie[]
 
 # tag::list_movies_by_genre[]
+# tag::list_movies_by_genre_cursor_encoding[]
+def encode_cursor(title: str, tmdb_id: str) -> str:
+    """Encode the sort key of the last movie on a page as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps([title, tmdb_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """Decode a cursor produced by encode_cursor into its title and TMDB ID."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor))
+    except ValueError:
+        raise ValueError(f"Invalid pagination cursor: {cursor!r}") from None
+
+    if not (isinstance(key, list) and len(key) == 2 and all(isinstance(part, str) for part in key)):
+        raise ValueError(f"Invalid pagination cursor: {cursor!r}")
+    title, tmdb_id = key
+    return title, tmdb_id
+# end::list_movies_by_genre_cursor_encoding[]
+
 # tag::list_movies_by_genre_def[]
+# Titles are not unique, so the TMDB ID breaks ties between movies with the same title
+LIST_MOVIES_BY_GENRE_QUERY = """
+MATCH (m:Movie)-[:IN_GENRE]->(g:Genre {name: $genre})
+WHERE m.title IS NOT NULL AND m.tmdbId IS NOT NULL
+RETURN m.tmdbId AS tmdbId,
+       m.title AS title,
+       m.released AS released,
+       m.imdbRating AS rating
+ORDER BY m.title ASC, m.tmdbId ASC
+LIMIT $limit
+"""
+
+# Later pages seek past the last movie seen. The m.title >= $after_title
+# conjunct is a plain range predicate the movie_title index can serve.
+LIST_MOVIES_BY_GENRE_AFTER_QUERY = """
+MATCH (m:Movie)-[:IN_GENRE]->(g:Genre {name: $genre})
+WHERE m.title >= $after_title AND m.tmdbId IS NOT NULL
+  AND (m.title > $after_title OR m.tmdbId > $after_id)
+RETURN m.tmdbId AS tmdbId,
+       m.title AS title,
+       m.released AS released,
+       m.imdbRating AS rating
+ORDER BY m.title ASC, m.tmdbId ASC
+LIMIT $limit
+"""
+
 @mcp.tool()
 async def list_movies_by_genre(
     genre: str,
     page_size: int = 10,
-    cursor: int = 0,
+    cursor: str | None = None,
     ctx: Context = None
 ) -> dict:
     """
@@ -221,60 +350,54 @@ async def list_movies_by_genre(
 
     Args:
         genre: Genre name (e.g., "Action", "Comedy", "Drama")
-        cursor: Pagination cursor - position in the result set (default "0")
-        page_size: Number of movies to return per page (default 10)
+        cursor: Pagination cursor - the next_cursor from the previous page (default None)
+        page_size: Number of movies to return per page (default 10, at most 500)
 
     Returns:
         Dictionary containing:
-        - movies: List of movie objects with title, released, and rating
+        - movies: List of movie objects with tmdbId, title, released, and rating
         - next_cursor: Cursor for the next page (null if no more pages)
-        - page: Current page number (1-indexed)
         - has_more: Boolean indicating if more pages are available
     """
     # end::list_movies_by_genre_def[]
 
     # tag::list_movies_by_genre_cursor[]
-    # Calculate skip value from cursor
-    skip = cursor * page_size
+    page_size = max(1, min(page_size, MAX_RESULTS))
+
+    # Decode the sort key of the last movie already seen
+    after_title, after_id = decode_cursor(cursor) if cursor else (None, None)
 
     # Log the request
-    page_num = (skip // page_size) + 1
-    await ctx.info(f"Fetching {genre} movies, page {page_num} (showing {page_size} per page)...")
+    position = f"after '{after_title}'" if cursor else "from the start"
+    await ctx.info(f"Fetching {genre} movies {position} (showing {page_size} per page)...")
     # end::list_movies_by_genre_cursor[]
 
     # tag::list_movies_by_genre_execute[]
     try:
-        # Access driver from lifespan context
-        driver = ctx.request_context.lifespan_context.driver
-
-        # Execute paginated query
-        records, summary, keys = await driver.execute_query(
-            """
-            MATCH (m:Movie)-[:IN_GENRE]->(g:Genre {name: $genre})
-            RETURN m.title AS title,
-                   m.released AS released,
-                   m.imdbRating AS rating
-            ORDER BY m.title ASC
-            SKIP $skip
-            LIMIT $limit
-            """,
+        # Access the query executor from lifespan context
+        execute = ctx.request_context.lifespan_context.execute
+
+        # Execute paginated query, seeking past the last movie seen
+        records, summary, keys = await execute(
+            LIST_MOVIES_BY_GENRE_AFTER_QUERY if cursor else LIST_MOVIES_BY_GENRE_QUERY,
             genre=genre,
-            skip=skip,
+            after_title=after_title,
+            after_id=after_id,
             limit=page_size
         )
 
         # Convert to list of dictionaries
-        movies = [record.data() for record in records]
+        movies = [dict(zip(keys, record.values())) for record in records]
         # end::list_movies_by_genre_execute[]
 
         # tag::list_movies_by_genre_return[]
-        # Calculate next cursor
+        # The last movie on a full page is the cursor for the next page
         next_cursor = None
         if len(movies) == page_size:
-            next_cursor = skip + page_size
+            next_cursor = encode_cursor(movies[-1]["title"], movies[-1]["tmdbId"])
 
         # Log results
-        await ctx.info(f"Returned {len(movies)} movies from page {page_num}")
+        await ctx.info(f"Returned {len(movies)} movies")
         if next_cursor is None:
             await ctx.info("This is the last page")
 
@@ -283,7 +406,6 @@ async def list_movies_by_genre(
             "genre": genre,
             "movies": movies,
             "next_cursor": next_cursor,
-            "page": page_num,
             "page_size": page_size,
             "has_more": next_cursor is not None
         }
@@ -294,7 +416,59 @@ async def list_movies_by_genre(
     # end::list_movies_by_genre_return[]
 # end::list_movies_by_genre[]
 
+class TTLCache:
+    """Small in-process LRU cache whose entries expire after a fixed time."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any | None:
+        """Return the cached value for key, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value under key, evicting the least recently used entry when full."""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# Read-only lookups whose results are cached for a few minutes
+CACHED_QUERIES = frozenset({GET_MOVIE_QUERY, LIST_MOVIES_BY_GENRE_QUERY, LIST_MOVIES_BY_GENRE_AFTER_QUERY})
+query_cache = TTLCache()
+
+
+def cache_reads(execute: Callable[..., Awaitable[EagerResult]]) -> Callable[..., Awaitable[EagerResult]]:
+    """Wrap a query executor so repeat CACHED_QUERIES lookups skip the database."""
+
+    async def cached_execute(query: str, **params: Any) -> EagerResult:
+        if query not in CACHED_QUERIES:
+            return await execute(query, **params)
+
+        key = (query, tuple(sorted(params.items())))
+        result = query_cache.get(key)
+        if result is None:
+            result = await execute(query, **params)
+            # Empty results are not cached so newly added data shows up straight away
+            if result.records:
+                query_cache.set(key, result)
+        return result
+
+    return cached_execute
+
+
 # tag::main[]
 if __name__ == "__main__":
-    mcp.run(transport="streamable-http")
+    mcp.run(transport=os.getenv("MCP_TRANSPORT", "streamable-http"))
 # end::main[]
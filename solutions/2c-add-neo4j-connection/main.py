@@ -1,10 +1,11 @@
 # tag::imports[]
 import os
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterator, Awaitable, Callable
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
+from functools import partial
 
-from neo4j import AsyncGraphDatabase, AsyncDriver
+from neo4j import AsyncGraphDatabase, AsyncDriver, EagerResult, RoutingControl
 from mcp.server.fastmcp import FastMCP
 
 # Load environment variables from .env file
@@ -14,11 +15,12 @@ load_dotenv()
 
 
 # tag::appcontext[]
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AppContext:
     """Application context with Neo4j driver."""
     driver: AsyncDriver
     database: str
+    execute: Callable[..., Awaitable[EagerResult]]
 # end::appcontext[]
 
 
@@ -33,12 +35,25 @@ async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
     password = os.getenv("NEO4J_PASSWORD", "password")
     database = os.getenv("NEO4J_DATABASE", "neo4j")
 
-    # Initialize driver on startup
-    driver = AsyncGraphDatabase.driver(uri, auth=(username, password))
+    # Initialize driver, giving up sooner than the driver's defaults
+    # when the pool is exhausted or the server is unreachable
+    driver = AsyncGraphDatabase.driver(
+        uri,
+        auth=(username, password),
+        connection_acquisition_timeout=30,
+        connection_timeout=10,
+    )
+
+    # Bind the database once so every query runs against it.
+    # The tools only read, so route their queries to any cluster member.
+    execute = partial(driver.execute_query, database_=database, routing_=RoutingControl.READ)
 
     try:
+        # Open a connection as the session starts rather than on its first tool call
+        await driver.verify_connectivity()
+
         # Yield context with driver
-        yield AppContext(driver=driver, database=database)
+        yield AppContext(driver=driver, database=database, execute=execute)
     finally:
         # Close driver on shutdown
         await driver.close()
@@ -53,27 +68,29 @@ mcp = FastMCP("Movies GraphRAG Server", lifespan=app_lifespan)
 # tag::graph_statistics[]
 from mcp.server.fastmcp import Context
 
+# Each unfiltered count is a query of its own so the planner answers it from the count store
+NODE_COUNT_QUERY = "MATCH (n) RETURN count(n) AS nodes"
+RELATIONSHIP_COUNT_QUERY = "MATCH ()-[r]->() RETURN count(r) AS relationships"
+
 @mcp.tool()
 async def graph_statistics(ctx: Context) -> dict[str, int]:
     """Count the number of nodes and relationships in the graph."""
 
-    # Access the driver from lifespan context
-    driver = ctx.request_context.lifespan_context.driver
-    database = ctx.request_context.lifespan_context.database
+    # Access the query executor from lifespan context
+    execute = ctx.request_context.lifespan_context.execute
 
-    # Use the driver to query Neo4j with the correct database
-    records, summary, keys = await driver.execute_query(
-        r"RETURN COUNT {()} AS nodes, COUNT {()-[]->()} AS relationships",
-        database_=database
-    )
+    # Query Neo4j for each count
+    node_records, _, _ = await execute(NODE_COUNT_QUERY)
+    relationship_records, _, _ = await execute(RELATIONSHIP_COUNT_QUERY)
 
-    # Process the results
-    if records:
-        return dict(records[0])
-    return {"nodes": 0, "relationships": 0}
+    # An aggregation without grouping keys always returns exactly one row
+    return {
+        "nodes": node_records[0]["nodes"],
+        "relationships": relationship_records[0]["relationships"],
+    }
 # end::graph_statistics[]
 
 # tag::main[]
 if __name__ == "__main__":
-    mcp.run(transport="streamable-http")
+    mcp.run(transport=os.getenv("MCP_TRANSPORT", "streamable-http"))
 # end::main[]
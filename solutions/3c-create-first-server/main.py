@@ -1,8 +1,16 @@
+import json
+import os
+import random
+
 from mcp.server.fastmcp import FastMCP
 
 # Create an MCP server
 mcp = FastMCP("Strawbrerry")
 
+# The fruits never change, so serialize them once at import
+FRUITS = ("apple", "strawberry", "banana")
+FRUITS_JSON = json.dumps(FRUITS, indent=2)
+
 @mcp.tool()
 def count_letters(text: str, search: str) -> int:
     """Count occurrences of a letter in the text"""
@@ -13,22 +21,22 @@ def list_fruits_prompt() -> str:
     """List all fruits"""
     return "Use the fruits resource to get all fruits"
 
-@mcp.resource("cupboard://fruits")
-def fruits() -> list[str]:
+@mcp.resource("cupboard://fruits", mime_type="application/json")
+def fruits() -> str:
     """Get all fruits"""
-    return ["apple", "strawberry", "banana"]
+    return FRUITS_JSON
 
 @mcp.resource("cupboard://fruits/{name}")
 def fruit(name: str) -> dict[str, str]:
     """Get a fruit by name"""
     return {
         "name": name,
-        "color": "yellow" if __import__("random").random() < 0.5 else "red",
-        "taste": "sour" if __import__("random").random() < 0.5 else "sweet",
+        "color": "yellow" if random.getrandbits(1) else "red",
+        "taste": "sour" if random.getrandbits(1) else "sweet",
     }
 
 # Run the server when executed directly
 if __name__ == "__main__":
     mcp.run(
-      transport="streamable-http"
+      transport=os.getenv("MCP_TRANSPORT", "streamable-http")
     )
\ No newline at end of file
@@ -1,10 +1,14 @@
 # tag::imports[]
+import asyncio
+import logging
 import os
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterator, Awaitable, Callable
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
+from functools import partial
 
-from neo4j import AsyncGraphDatabase, AsyncDriver
+from neo4j import AsyncGraphDatabase, AsyncDriver, EagerResult, RoutingControl
+from neo4j.exceptions import Neo4jError
 from mcp.server.fastmcp import FastMCP
 
 # Load environment variables from .env file
@@ -14,18 +18,49 @@ load_dotenv()
 
 
 # tag::appcontext[]
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AppContext:
     """Application context with Neo4j driver."""
     driver: AsyncDriver
     database: str
+    execute: Callable[..., Awaitable[EagerResult]]
 # end::appcontext[]
 
 
 # tag::lifespan[]
-@asynccontextmanager
-async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
-    """Manage Neo4j driver lifecycle."""
+# Indexes that turn the tools' genre filter, movie lookup and title ordering into seeks
+INDEX_STATEMENTS = (
+    "CREATE RANGE INDEX movie_title IF NOT EXISTS FOR (m:Movie) ON (m.title)",
+    "CREATE RANGE INDEX movie_tmdb_id IF NOT EXISTS FOR (m:Movie) ON (m.tmdbId)",
+    "CREATE RANGE INDEX genre_name IF NOT EXISTS FOR (g:Genre) ON (g.name)",
+)
+indexes_created = False
+
+logger = logging.getLogger(__name__)
+
+
+async def create_indexes(execute: Callable[..., Awaitable[EagerResult]]) -> None:
+    """Create each tool index once per process, continuing without any that fail."""
+    global indexes_created
+    if indexes_created:
+        return
+    indexes_created = True
+
+    for statement in INDEX_STATEMENTS:
+        try:
+            await execute(statement, routing_=RoutingControl.WRITE)
+        except Neo4jError as e:
+            logger.warning("Could not create index, continuing without it: %s", e)
+
+
+# One driver, connection pool and routing table shared by every MCP session
+shared_context: AppContext | None = None
+session_count = 0
+shared_context_lock = asyncio.Lock()
+
+
+async def create_app_context() -> AppContext:
+    """Create the Neo4j driver and the query executor used by the tools."""
 
     # Read connection details from environment
     uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
@@ -33,47 +68,100 @@ async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
     password = os.getenv("NEO4J_PASSWORD", "password")
     database = os.getenv("NEO4J_DATABASE", "neo4j")
 
-    # Initialize driver on startup
-    driver = AsyncGraphDatabase.driver(uri, auth=(username, password))
+    # Initialize driver, giving up sooner than the driver's defaults
+    # when the pool is exhausted or the server is unreachable
+    driver = AsyncGraphDatabase.driver(
+        uri,
+        auth=(username, password),
+        connection_acquisition_timeout=30,
+        connection_timeout=10,
+    )
+
+    # Bind the database once so every query runs against it.
+    # The tools only read, so route their queries to any cluster member.
+    execute = partial(driver.execute_query, database_=database, routing_=RoutingControl.READ)
+
+    try:
+        # Open a connection now rather than on the first query
+        await driver.verify_connectivity()
+
+        # Make sure the indexes used by the tools exist
+        await create_indexes(execute)
+    except Exception:
+        await driver.close()
+        raise
+
+    return AppContext(driver=driver, database=database, execute=execute)
+
+
+@asynccontextmanager
+async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
+    """Share one Neo4j driver across MCP sessions, closing it with the last one."""
+    global shared_context, session_count
+
+    # FastMCP enters the lifespan once per session, so reuse the driver
+    # of any session that is still open
+    async with shared_context_lock:
+        if shared_context is None:
+            shared_context = await create_app_context()
+        session_count += 1
 
     try:
         # Yield context with driver
-        yield AppContext(driver=driver, database=database)
+        yield shared_context
     finally:
-        # Close driver on shutdown
-        await driver.close()
+        # Close driver on shutdown, once no session is using it
+        async with shared_context_lock:
+            session_count -= 1
+            if session_count == 0:
+                await shared_context.driver.close()
+                shared_context = None
 # end::lifespan[]
 
 # tag::server[]
 # Create server with lifespan
 mcp = FastMCP("Movies GraphRAG Server", lifespan=app_lifespan)
+
+# Cap on rows per tool call so a large limit cannot buffer an unbounded result
+MAX_RESULTS = 500
 # end::server[]
 
 
 # tag::graph_statistics[]
 from mcp.server.fastmcp import Context
 
+# Each unfiltered count is a query of its own so the planner answers it from the count store
+NODE_COUNT_QUERY = "MATCH (n) RETURN count(n) AS nodes"
+RELATIONSHIP_COUNT_QUERY = "MATCH ()-[r]->() RETURN count(r) AS relationships"
+
 @mcp.tool()
 async def graph_statistics(ctx: Context) -> dict[str, int]:
     """Count the number of nodes and relationships in the graph."""
 
-    # Access the driver from lifespan context
-    driver = ctx.request_context.lifespan_context.driver
-    database = ctx.request_context.lifespan_context.database
+    # Access the query executor from lifespan context
+    execute = ctx.request_context.lifespan_context.execute
 
-    # Use the driver to query Neo4j with the correct database
-    records, summary, keys = await driver.execute_query(
-        r"RETURN COUNT {()} AS nodes, COUNT {()-[]-()} AS relationships",
-        database_=database
-    )
+    # Query Neo4j for each count
+    node_records, _, _ = await execute(NODE_COUNT_QUERY)
+    relationship_records, _, _ = await execute(RELATIONSHIP_COUNT_QUERY)
 
-    # Process the results
-    if records:
-        return dict(records[0])
-    return {"nodes": 0, "relationships": 0}
+    # An aggregation without grouping keys always returns exactly one row
+    return {
+        "nodes": node_records[0]["nodes"],
+        "relationships": relationship_records[0]["relationships"],
+    }
 # end::graph_statistics[]
 
 # tag::get_movies_by_genre[]
+MOVIES_BY_GENRE_QUERY = """
+MATCH (m:Movie)-[:IN_GENRE]->(g:Genre {name: $genre})
+RETURN m.title AS title,
+       m.imdbRating AS imdbRating,
+       m.released AS released
+ORDER BY coalesce(m.imdbRating, 0) DESC
+LIMIT $limit
+"""
+
 @mcp.tool()
 async def get_movies_by_genre(genre: str, limit: int = 10, ctx: Context = None) -> list[dict]:
     """
@@ -81,39 +169,34 @@ async def get_movies_by_genre(genre: str, limit: int = 10, ctx: Context = None)
 
     Args:
         genre: The genre to search for (e.g., "Action", "Drama", "Comedy")
-        limit: Maximum number of movies to return (default: 10)
+        limit: Maximum number of movies to return (default: 10, at most 500)
         ctx: Context object (injected automatically)
 
     Returns:
         List of movies with title, tagline, and release year
     """
 
+    limit = max(1, min(limit, MAX_RESULTS))
+
     # Log the request
     await ctx.info(f"Searching for {genre} movies (limit: {limit})...")
 
-    # Access the Neo4j driver from lifespan context
-    driver = ctx.request_context.lifespan_context.driver
+    # Access the query executor from lifespan context
+    execute = ctx.request_context.lifespan_context.execute
 
     # Log the query execution
     await ctx.debug(f"Executing Cypher query for genre: {genre}")
 
     try:
         # Execute the query
-        records, summary, keys = await driver.execute_query(
-            """
-            MATCH (m:Movie)-[:IN_GENRE]->(g:Genre {name: $genre})
-            RETURN m.title AS title,
-                   m.imdbRating AS imdbRating,
-                   m.released AS released
-            ORDER BY coalesce(m.imdbRating, 0) DESC
-            LIMIT $limit
-            """,
+        records, summary, keys = await execute(
+            MOVIES_BY_GENRE_QUERY,
             genre=genre,
             limit=limit
         )
 
         # Convert records to list of dictionaries
-        movies = [record.data() for record in records]
+        movies = [dict(zip(keys, record.values())) for record in records]
 
         # Log the result
         await ctx.info(f"Found {len(movies)} {genre} movies")
@@ -131,5 +214,5 @@ async def get_movies_by_genre(genre: str, limit: int = 10, ctx: Context = None)
 
 # tag::main[]
 if __name__ == "__main__":
-    mcp.run(transport="streamable-http")
+    mcp.run(transport=os.getenv("MCP_TRANSPORT", "streamable-http"))
 # end::main[]